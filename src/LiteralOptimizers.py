@@ -14,7 +14,18 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import json, struct, math, decimal, Errors
+import json, struct, math, decimal, re, Errors
+
+# What json.dumps escapes each ASCII character to (most are left alone).
+_ESCAPE = [chr(c) if 0x20 <= c < 0x7f else '\\u%04x' % c for c in xrange(128)]
+for c, escaped in [('"', '\\"'), ('\\', '\\\\'), ('\n', '\\n'), ('\r', '\\r'),
+    ('\t', '\\t'), ('\b', '\\b'), ('\f', '\\f')]:
+  _ESCAPE[ord(c)] = escaped
+del c, escaped
+_NEEDS_ESCAPE = re.compile(r'[\x00-\x1f"\\\x7f]')
+_NON_ASCII = re.compile(r'[^\x00-\x7f]')
+
+SMALL_INT_LIMIT = 10000
 
 def optimal_int(i, allowHex=False):
   """
@@ -22,17 +33,30 @@ def optimal_int(i, allowHex=False):
   converted to hexadecimal if it's shorter to do so (hexadecimal numbers aren't
   included in the JSON specification).
   """
+  if type(i) is int and -SMALL_INT_LIMIT <= i <= SMALL_INT_LIMIT:
+    return _SMALL_INTS[i + SMALL_INT_LIMIT]
+  return _optimal_int(i, allowHex)
+
+def _optimal_int(i, allowHex):
+  """
+  The uncached implementation of optimal_int().
+  """
   normal = '%d' % i
-  power = 1000
-  if i % power == 0 and i != 0:
-    while i % power == 0:
-      power *= 10
-    power /= 10
-    normal = '%de%d' % (i/power, int(math.log10(power)))
+  if i != 0:
+    # Three or more trailing zeros are shorter written as an exponent.
+    stripped = normal.rstrip('0')
+    zeros = len(normal) - len(stripped)
+    if zeros >= 3:
+      normal = '%se%d' % (stripped, zeros)
   if allowHex and len(hex(i)) < len(normal):
     return hex(i)
   return normal
 
+# optimal_int() of every integer in [-SMALL_INT_LIMIT, SMALL_INT_LIMIT], which
+# covers most of the integers that show up in practice. Hexadecimal is never
+# shorter for numbers this small, so these don't depend on allowHex.
+_SMALL_INTS = tuple([_optimal_int(i, False) for i in xrange(-SMALL_INT_LIMIT, SMALL_INT_LIMIT + 1)])
+
 def optimal_float(f, sigdigits=None, allowHex=False):
   """
   Return f in a form as short as possible. If allowHex is true, f can be
@@ -45,30 +69,31 @@ def optimal_float(f, sigdigits=None, allowHex=False):
   written as an integer and one written as a float.
   """
   
-  if sigdigits == None:
-    # Python's repr() function automatically chooses the shortest representation
-    # which represents the corresponding IEEE-754 float.
-    # Note that sometimes this uses E notation, which for some reason uses
-    # a two character default (i.e. 1e06 rather than 1e6).
-    # The conditions under which is switches to exponent notation are also
-    # suboptimal for space considerations (1000000 vs. 1e6). (TODO -- although
-    # will it ever matter? Since optimal_int takes this into account.)
+  if sigdigits != None:
+    # Round first, then find the shortest way of writing the rounded value.
+    # Decimals (which is what RCFJ.py parses floats as) are rounded exactly, in
+    # a context of their own rather than the thread's.
     if isinstance(f, decimal.Decimal):
-      floatversion = str(abs(f)).lstrip('0')
+      f = decimal.Context(prec=sigdigits).plus(f)
     else:
-      floatversion = repr(abs(f)).lstrip('0')
-    if f < 0:
-      floatversion = '-%s' % floatversion
-    if floatversion.find('e') != -1:
-      digits, exponent = floatversion.split('e', 1)
-      floatversion = '%sE%s' % (digits, optimal_int(int(exponent), allowHex=False))
+      f = float('%.*g' % (sigdigits, f))
+  
+  # Python's repr() function automatically chooses the shortest representation
+  # which represents the corresponding IEEE-754 float.
+  # Note that sometimes this uses E notation, which for some reason uses
+  # a two character default (i.e. 1e06 rather than 1e6).
+  # The conditions under which is switches to exponent notation are also
+  # suboptimal for space considerations (1000000 vs. 1e6). (TODO -- although
+  # will it ever matter? Since optimal_int takes this into account.)
+  if isinstance(f, decimal.Decimal):
+    floatversion = str(abs(f)).lstrip('0')
   else:
-    d = decimal.Decimal(f)
-    prior = decimal.getcontext().prec
-    decimal.getcontext().prec = sigdigits
-    d += 0
-    decimal.getcontext().prec = prior
-    return optimal_float(d, sigdigits=None, allowHex=allowHex)
+    floatversion = repr(abs(f)).lstrip('0')
+  if f < 0:
+    floatversion = '-%s' % floatversion
+  if floatversion.find('e') != -1:
+    digits, exponent = floatversion.split('e', 1)
+    floatversion = '%sE%s' % (digits, optimal_int(int(exponent), allowHex=False))
   
   integerversion = optimal_int(int(math.floor(f)), allowHex=allowHex)
   if int(f) == f and len(integerversion) <= len(floatversion):
@@ -99,28 +124,93 @@ def optimal_null(s):
 
 def optimal_string(s):
   """
-  Return the shortest representation of s as a string literal. Currently this
-  is outsourced to Python's json library, which handles all sorts of escaping
+  Return the shortest representation of s as a string literal. ASCII strings
+  are escaped here, using the same escapes as Python's json library; anything
+  else is outsourced to the json library, which handles all sorts of escaping
   complexities.
   """
-  return json.dumps(s)
+  if _NON_ASCII.search(s) is not None:
+    return json.dumps(s)
+  if _NEEDS_ESCAPE.search(s) is None:
+    return '"%s"' % s
+  return '"%s"' % ''.join([_ESCAPE[ord(c)] for c in s])
+
+# Results of optimal(), keyed on the literal's type and value plus the options
+# that affect its encoding. The same literals tend to recur throughout a
+# document (that's what symbolization exploits), so each is only encoded once.
+_optimal_cache = {}
 
 def optimal(struct, options):
   """
   Return the shortest string representation of struct, a literal (Python bool,
   float, int, unicode, str, or None) or else raise
-  IncontrovertiblyInconvertible.
+  IncontrovertiblyInconvertible. Results are memoized, see _optimal_cache.
   """
+  if options:
+    flags = (options['allowHex'], options['allowBooleanNumbers'], options['significantFigures'])
+  else:
+    flags = (False, False, None)
+  kind = type(struct)
+  # Equal Decimals don't necessarily print the same (0.1 vs. 0.10), so they're
+  # cached by their text instead.
+  if kind is decimal.Decimal:
+    key = (kind, str(struct), flags)
+  else:
+    key = (kind, struct, flags)
+  try:
+    return _optimal_cache[key]
+  except KeyError:
+    result = _optimal_cache[key] = _optimal(struct, *flags)
+  except TypeError:
+    # Unhashable, so certainly not a literal. Let _optimal raise.
+    result = _optimal(struct, *flags)
+  return result
+
+# _optimal's handler for each literal type json.load produces. Handlers are
+# called with the literal and the unpacked options.
+def _handle_boolean(b, allowHex, allowBooleanNumbers, significantFigures):
+  return optimal_boolean(b, allowBooleanNumbers=allowBooleanNumbers)
+
+def _handle_int(i, allowHex, allowBooleanNumbers, significantFigures):
+  return optimal_int(i, allowHex=allowHex)
+
+def _handle_float(f, allowHex, allowBooleanNumbers, significantFigures):
+  return optimal_float(f, sigdigits=significantFigures, allowHex=allowHex)
+
+def _handle_string(s, allowHex, allowBooleanNumbers, significantFigures):
+  return optimal_string(s)
+
+def _handle_null(n, allowHex, allowBooleanNumbers, significantFigures):
+  return optimal_null(n)
+
+_DISPATCH = {bool: _handle_boolean, int: _handle_int, float: _handle_float,
+    decimal.Decimal: _handle_float, str: _handle_string, unicode: _handle_string,
+    type(None): _handle_null}
+
+def _optimal(struct, allowHex, allowBooleanNumbers, significantFigures):
+  """
+  The uncached implementation of optimal(), with the options already unpacked.
+  """
+  # Exact types are dispatched through _DISPATCH (bool is a type of its own
+  # there, so it can't be mistaken for an int). The isinstance cascade below is
+  # only reached for subclasses.
+  try:
+    handler = _DISPATCH[type(struct)]
+  except KeyError:
+    pass
+  else:
+    return handler(struct, allowHex, allowBooleanNumbers, significantFigures)
+  
   if isinstance(struct, bool):
     # It's important that this comes before int, because isinstance(True, int)==True
-    return optimal_boolean(struct, allowBooleanNumbers=options['allowBooleanNumbers'])
+    return optimal_boolean(struct, allowBooleanNumbers=allowBooleanNumbers)
   elif isinstance(struct, float) or isinstance(struct, decimal.Decimal):
-    return optimal_float(struct, allowHex=options['allowHex'], sigdigits=options['significantFigures'])
+    return optimal_float(struct, allowHex=allowHex, sigdigits=significantFigures)
   elif isinstance(struct, int):
-    return optimal_int(struct, allowHex=options['allowHex'])
+    return optimal_int(struct, allowHex=allowHex)
   elif isinstance(struct, unicode) or isinstance(struct, str):
     return optimal_string(struct)
   elif struct == None:
     return optimal_null(struct)
   else:
-    raise Errors.IncontrovertiblyInconvertible('LiteralOptimizers.optimal didn\'t recognize the datatype, and doesn\'t know what to do with it.')
\ No newline at end of file
+    raise Errors.IncontrovertiblyInconvertible('LiteralOptimizers.optimal didn\'t recognize the datatype, and doesn\'t know what to do with it.')
@@ -42,77 +42,73 @@ Options:
                         names in common. (NON-COMPLIANT.)
 """
 
-import json, re, decimal
+import json, re, decimal, itertools, operator
+from collections import deque, defaultdict
 import LiteralOptimizers, Errors
 
 VARIABLE_START = u'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ_$'
 VARIABLE_MID = VARIABLE_START + '0123456789'
 
+# Both keywords & variables that you shouldn't (and sometimes can't) override.
+KEYWORDS = frozenset(['false', 'debugger', 'synchronized', 'int', 'abstract',
+    'float', 'private', 'self', 'char', 'interface', 'boolean', 'export', 'in',
+    'null', 'if', 'true', 'const', 'for', 'with', 'top', 'NaN', 'while', 'long',
+    'throw', 'finally', 'protected', 'extends', 'implements', 'var', 'import',
+    'native', 'final', 'location', 'function', 'do', 'return', 'goto', 'void',
+    'enum', 'else', 'break', 'transient', 'window', 'new', 'catch',
+    'instanceof', 'byte', 'super', 'class', 'volatile', 'case', 'short',
+    'undefined', 'package', 'default', 'double', 'public', 'try', 'this',
+    'switch', 'continue', 'typeof', 'static', 'throws', 'delete'])
+
 def VariableGenerator(length):
   """
   A variable generator of length L will iterate over all valid variable names
   of length L (avoiding keywords and reserved variable names).
   """
-  # This list contains both keywords & variables that you shouldn't (and
-  # sometimes can't) override.
-  keywords = ['false', 'debugger', 'synchronized', 'int', 'abstract', 'float',
-      'private', 'self', 'char', 'interface', 'boolean', 'export', 'in', 'null',
-      'if', 'true', 'const', 'for', 'with', 'top', 'NaN', 'while', 'long',
-      'throw', 'finally', 'protected', 'extends', 'implements', 'var', 'import',
-      'native', 'final', 'location', 'function', 'do', 'return', 'goto', 'void',
-      'enum', 'else', 'break', 'transient', 'window', 'new', 'catch',
-      'instanceof', 'byte', 'super', 'class', 'volatile', 'case', 'short',
-      'undefined', 'package', 'default', 'double', 'public', 'try', 'this',
-      'switch', 'continue', 'typeof', 'static', 'throws', 'delete']
-  keywords = [x for x in keywords if len(x) == length]
-  state = [0]*length
-  state[0] = -1
-  while True:
-    state[-1] += 1
-    i = length - 1
-    while i >= 0:
-      maxsize = len(VARIABLE_MID)
-      if i == 0:
-        maxsize = len(VARIABLE_START)
-      if state[i] >= maxsize and i != 0:
-        state[i-1] += 1
-        state[i] = 0
-      elif state[i] >= maxsize and i == 0:
-        return
-      i -= 1
-    s = []
-    for i in xrange(length):
-      if i == 0:
-        s.append(VARIABLE_START[state[i]])
-      else:
-        s.append(VARIABLE_MID[state[i]])
+  # The n-th name is n written in a mixed radix: the first character is a
+  # digit in base len(VARIABLE_START), the remaining ones in base
+  # len(VARIABLE_MID).
+  base = len(VARIABLE_MID)
+  tail = base ** (length - 1)
+  for n in xrange(len(VARIABLE_START) * tail):
+    first, rest = divmod(n, tail)
+    s = [None]*length
+    s[0] = VARIABLE_START[first]
+    for i in xrange(length - 1, 0, -1):
+      rest, digit = divmod(rest, base)
+      s[i] = VARIABLE_MID[digit]
     as_name = ''.join(s)
-    if as_name not in keywords:
+    if as_name not in KEYWORDS:
       yield as_name
 
-class StructurePositionIdentifier:
+def VariableNames():
+  """
+  Iterate over all valid variable names, shortest first (i.e. every name
+  VariableGenerator(1) gives, then every name VariableGenerator(2) gives...).
+  """
+  for length in itertools.count(1):
+    for name in VariableGenerator(length):
+      yield name
+
+class StructurePositionIdentifier(object):
   """
   Uniquely specifies a single instance of a literal value in JSON using its
-  position in the structure. Supports rich comparison.
+  position in the structure. Supports rich comparison; an identifier is less
+  than another if it points somewhere inside the structure the other points to.
   """
+  __slots__ = ('path',)
   def __init__(self, path):
     self.path = tuple(path)
   def __eq__(self, other):
     return self.path == other.path
+  def __hash__(self):
+    return hash(self.path)
   def __lt__(self, other):
-    if len(self.path) <= len(other.path):
-      return False
-    for i,e in enumerate(other.path):
-      if e != self.path[i]:
-        return False
-    return True
+    n = len(other.path)
+    return len(self.path) > n and self.path[:n] == other.path
   def __gt__(self, other):
-    if len(self.path) >= len(other.path):
-      return False
-    for i,e in enumerate(self.path):
-      if e != other.path[i]:
-        return False
-    return True
+    n = len(self.path)
+    return len(other.path) > n and other.path[:n] == self.path
   def __le__(self, other):
     return not self.__gt__(other)
   def __ge__(self, other):
@@ -124,16 +120,21 @@ class StructurePositionIdentifier:
       onObject = onObject[next]
     return onObject
 
-class Proposal:
+class Proposal(object):
   """
   A proposal represents an option to replace a data structure (object, array,
   or basic literal) with something else. It handles creation of the foreword
   (something that needs to be assigned beforehand) and assesses the potential
   savings of the replacement in terms of the length of the variable it gets
-  to use.
+  to use (savings(varlength), implemented by subclasses).
+  
+  apply() describes the replacement as (opening, children, closing): writeJSON
+  emits opening, then each child structure (comma separated), then closing.
   """
-  def __init__(self, savings_func, foreword):
-    self.savings = savings_func
+  # _s1 and _s2 hold savings(1) and savings(2) while assign_proposals_greedy
+  # sorts by them.
+  __slots__ = ('foreword', 'variable', '_s1', '_s2')
+  def __init__(self, foreword):
     self.foreword = foreword
     self.variable = None
   def assign(self, variable):
@@ -150,14 +151,17 @@ class SymbolizedLiteralProposal(Proposal):
   A proposal that replaces a literal (number or string) with a variable name,
   e.g. 3.14159 -> p
   """
-  def __init__(self, save, foreword, value):
+  __slots__ = ('value', 'literal_cost', 'occur', 'init_cost')
+  def __init__(self, foreword, value, literal_cost, occur, init_cost):
     self.value = value
-    Proposal.__init__(self, save, foreword)
-  def applies(self, struct):
-    if struct == self.value:
-      return True
-  def apply(self, struct, proposals, options):
-    return self.variable
+    self.literal_cost = literal_cost
+    self.occur = occur
+    self.init_cost = init_cost
+    Proposal.__init__(self, foreword)
+  def savings(self, varlength):
+    return (self.literal_cost*self.occur)-(varlength*self.occur+self.init_cost+varlength)
+  def apply(self, struct):
+    return self.variable, (), ''
   def __repr__(self):
     return '<Proposal to save (%d,%d,%d) bytes with a (%d,%d,%d)-variable (literal: %r)>' % (self.savings(1), self.savings(2), self.savings(3), 1, 2, 3, self.value)
 
@@ -169,22 +173,19 @@ class RecordProposal(Proposal):
   f(4,5)
   (This becomes advantageous when you have many objects with the same key set).
   """
-  def __init__(self, save, foreword, keys):
+  __slots__ = ('keys', 'occur', 'keyset_size', 'keyset_len', 'foreword_len')
+  def __init__(self, foreword, keys, occur, keyset_size, keyset_len, foreword_len):
     self.keys = keys
-    Proposal.__init__(self, save, foreword)
-  def applies(self, struct):
-    if isinstance(struct, dict):
-      key = struct.keys()
-      key.sort()
-      if tuple(key) == self.keys:
-        return True
-  def apply(self, struct, proposals, options):
-    args = []
-    keys = struct.keys()
-    keys.sort()
-    for key in keys:
-      args.append(writeJSON(struct[key], proposals, options=options))
-    return self.variable + '(' + ','.join(args) + ')'
+    self.occur = occur
+    self.keyset_size = keyset_size
+    self.keyset_len = keyset_len
+    self.foreword_len = foreword_len
+    Proposal.__init__(self, foreword)
+  def savings(self, varlength):
+    occur, keyset_len = self.occur, self.keyset_len
+    return occur*(2+self.keyset_size+2*keyset_len) - (self.foreword_len + varlength + occur*(2+varlength+keyset_len))
+  def apply(self, struct):
+    return self.variable + '(', [struct[key] for key in self.keys], ')'
 
 def generate_symbolized_literal_proposals(struct, options=None):
   """
@@ -194,29 +195,26 @@ def generate_symbolized_literal_proposals(struct, options=None):
   if options == None:
     options = get_default_options()
   
-  frequency = {}
-  explore = [struct]
-  while len(explore) > 0:
-    node = explore.pop(0)
+  # Booleans are counted on their own, since True == 1 and False == 0.
+  frequency = defaultdict(int)
+  booleans = defaultdict(int)
+  explore = deque([struct])
+  while explore:
+    node = explore.popleft()
     if isinstance(node, list):
-      for element in node:
-        explore.append(element)
+      explore.extend(node)
     elif isinstance(node, dict):
-      for k in node:
-        explore.append(node[k])
+      explore.extend(node.itervalues())
+    elif type(node) is bool:
+      booleans[node] += 1
     else:
-      frequency[node] = frequency.get(node,0) + 1
-  
-  def saved(literal_cost, occur, init_cost):
-    def f(varlength):
-      return (literal_cost*occur)-(varlength*occur+init_cost+varlength)
-    return f
+      frequency[node] += 1
   
   proposals = []
-  for k in frequency:
+  for k, occur in itertools.chain(frequency.iteritems(), booleans.iteritems()):
     best = LiteralOptimizers.optimal(k, options)
     #init_cost is semi-special here
-    proposal = SymbolizedLiteralProposal(saved(len(best), frequency[k], 2+len(best)), '%%s=%s'%best, k)
+    proposal = SymbolizedLiteralProposal('%%s=%s'%best, k, len(best), occur, 2+len(best))
     if proposal.savings(1) > 0:
       proposals.append(proposal)
   
@@ -232,49 +230,27 @@ def generate_record_proposals(struct, options=None):
   #it's important that the savings for non-literal proposals are the savings from
   # *structure only*. The literal values are considered separately.
   
-  frequency = {}
-  explore = [struct]
-  while len(explore) > 0:
-    node = explore.pop(0)
+  frequency = defaultdict(int)
+  explore = deque([struct])
+  while explore:
+    node = explore.popleft()
     if isinstance(node, list):
-      for element in node:
-        explore.append(element)
+      explore.extend(node)
     elif isinstance(node, dict):
-      keylist = node.keys()
-      keylist.sort()
-      keylist = tuple(keylist)
-      
-      frequency[keylist] = frequency.get(keylist,0) + 1
+      frequency[tuple(sorted(node))] += 1
       
-      for k in node:
-        explore.append(node[k])
+      explore.extend(node.itervalues())
   
   
-  def saved(occur, keyset_size, keyset_len, foreword_len):
-    def f(varlength):
-      return occur*(2+keyset_size+2*keyset_len) - (foreword_len + varlength + occur*(2+varlength+keyset_len))
-    return f
-  
   proposals = []
   for k in frequency:
-    arguments = []
-    vlen = 1
-    i = len(k)
-    generator = VariableGenerator(vlen)
-    while i > 0:
-      for name in generator:
-        arguments.append(name)
-        i -= 1
-        if i == 0:
-          break
-      vlen += 1
-      generator = VariableGenerator(vlen)
+    arguments = list(itertools.islice(VariableNames(), len(k)))
     
     mappings = ['%s:%s' % (key,arg) for key,arg in zip(k,arguments)]
     
     foreword = 'function %%s(%s){return {%s};};' % (','.join(arguments), ','.join(mappings))
 
-    proposal = RecordProposal(saved(frequency[k], sum([len(x) for x in k]), len(k), len(foreword)-2), foreword, k)
+    proposal = RecordProposal(foreword, k, frequency[k], sum([len(x) for x in k]), len(k), len(foreword)-2)
     if proposal.savings(1) > 0:
       proposals.append(proposal)
   
@@ -309,70 +285,157 @@ def get_default_options():
   return {'keysAreStrings': True, 'allowHex': False, 'allowBooleanNumbers': False, 'significantFigures': None}
 
 
-def writeJSON(struct, proposals, options=None):
+def index_proposals(proposals):
+  """
+  Return (literals, booleans, records), dictionaries for looking up the
+  proposal (if any) which replaces a structure. literals is keyed on the
+  literal value, booleans on True/False (kept apart since True == 1 and
+  False == 0), records on the frozenset of the object's keys. If several
+  proposals replace the same structure the first one wins.
+  """
+  literals = {}
+  booleans = {}
+  records = {}
+  for proposal in proposals:
+    if isinstance(proposal, RecordProposal):
+      records.setdefault(frozenset(proposal.keys), proposal)
+    elif type(proposal.value) is bool:
+      booleans.setdefault(proposal.value, proposal)
+    else:
+      literals.setdefault(proposal.value, proposal)
+  return literals, booleans, records
+
+# writeJSON's main loop. It's specialized (see _get_writer) by filling in the
+# parts that depend on the options and on which kinds of proposal there are, so
+# the loop doesn't keep checking those for every node.
+_WRITER_TEMPLATE = """
+def write(struct, options, literalProposals, booleanProposals, recordProposals, parts):
+  optimal = LiteralOptimizers.optimal
+  emit = parts.append
+  # Work stack of (item, isToken) pairs. Tokens go straight to the output, any
+  # other item is a structure still to be written. Everything is pushed in
+  # reverse so that it pops off in output order.
+  stack = [(struct, False)]
+  push = stack.append
+  pop = stack.pop
+  while stack:
+    node, isToken = pop()
+    if isToken:
+      emit(node)
+      continue
+    
+    if isinstance(node, dict):
+      proposal = %(record_lookup)s
+      if proposal is None:
+        emit('{')
+        push(('}', True))
+        keys = list(node)
+        for i in xrange(len(keys) - 1, -1, -1):
+          key = keys[i]
+          push((node[key], False))
+          push((%(key_token)s, True))
+          if i:
+            push((',', True))
+        continue
+    elif isinstance(node, list):
+      emit('[')
+      push((']', True))
+      for i in xrange(len(node) - 1, -1, -1):
+        push((node[i], False))
+        if i:
+          push((',', True))
+      continue
+    else:
+      proposal = %(literal_lookup)s
+      if proposal is None:
+        if isinstance(node, JavascriptExpression):
+          emit(str(node))
+          continue
+        emit(optimal(node, options))
+        continue
+    
+    opening, children, closing = proposal.apply(node)
+    emit(opening)
+    push((closing, True))
+    for i in xrange(len(children) - 1, -1, -1):
+      push((children[i], False))
+      if i:
+        push((',', True))
+"""
+
+_writers = {}
+
+def _get_writer(keysAreStrings, hasLiteralProposals, hasRecordProposals):
+  """
+  Return writeJSON's main loop compiled for the given settings (compiling it
+  the first time those settings are seen).
+  """
+  settings = (bool(keysAreStrings), bool(hasLiteralProposals), bool(hasRecordProposals))
+  if settings not in _writers:
+    source = _WRITER_TEMPLATE % {
+      'key_token': "'\"' + key + '\":'" if keysAreStrings else "key + ':'",
+      'literal_lookup': '(booleanProposals if type(node) is bool else literalProposals).get(node)' if hasLiteralProposals else 'None',
+      'record_lookup': 'recordProposals.get(frozenset(node))' if hasRecordProposals else 'None',
+    }
+    namespace = {'LiteralOptimizers': LiteralOptimizers, 'JavascriptExpression': JavascriptExpression}
+    exec compile(source, '<writeJSON %r>' % (settings,), 'exec') in namespace
+    _writers[settings] = namespace['write']
+  return _writers[settings]
+
+def writeJSON(struct, proposals, options=None, out=None):
   """
   Translate struct to JSON, in a manner similar to json.dumps(). Proposals is a
-  list of Proposal objects which will be .apply()d if they .applies(). Options
-  is a dictionary with keys like those in get_default_options() (although
-  perhaps with different values).
+  list of Proposal objects which will be .apply()d to whatever they replace.
+  Options is a dictionary with keys like those in get_default_options()
+  (although perhaps with different values). If out, a list, is given the
+  output is appended to it piece by piece (to be ''.join()ed by the caller)
+  and nothing is returned.
   """
   if options == None:
     options = get_default_options()
-  for proposal in proposals:
-    if proposal.applies(struct):
-      return proposal.apply(struct, proposals, options)
+  literalProposals, booleanProposals, recordProposals = index_proposals(proposals)
+  write = _get_writer(options['keysAreStrings'], literalProposals or booleanProposals, recordProposals)
   
-  output = []
-  if isinstance(struct, dict):
-    output.append('{')
-    temp = []
-    for key in struct:
-      if options['keysAreStrings']:
-        temp.append('"' + key + '":' + writeJSON(struct[key],  proposals, options=options))
-      else:
-        temp.append(key + ':' + writeJSON(struct[key],  proposals, options=options))
-    output.append(','.join(temp))
-    output.append('}')
-  elif isinstance(struct, list):
-    output.append('[')
-    temp = []
-    for item in struct:
-      temp.append(writeJSON(item,  proposals, options=options))
-    output.append(','.join(temp))
-    output.append(']')
-  elif isinstance(struct, JavascriptExpression):
-    output.append(str(struct))
-  else:
-    output.append(LiteralOptimizers.optimal(struct, options))
-  return ''.join(output)
+  parts = [] if out is None else out
+  write(struct, options, literalProposals, booleanProposals, recordProposals, parts)
+  if out is None:
+    return ''.join(parts)
 
 
 def assign_proposals_greedy(proposals):
   """
   Return a sorted list of the most advantageous proposals, after assigning them
-  variables. This is a simple greedy algorithm which furthermore only tries up
-  to variables of length 2.
+  variables. This is a simple greedy algorithm. Names are taken shortest first
+  from a single VariableNames() stream, with no cap on their length.
   """
   assigned = []
+  names = VariableNames()
   
-  proposals.sort(key=lambda x:x.savings(1), reverse=True)
+  for proposal in proposals:
+    proposal._s1 = proposal.savings(1)
+    proposal._s2 = proposal.savings(2)
   
-  # At the moment this only considers 1 and 2 length variables (very rarely
-  # would 3 be useful).
-  for i,proposal in enumerate(proposals[:len(VARIABLE_START)]):
-    if proposal.savings(1) <= 0:
+  proposals.sort(key=operator.attrgetter('_s1'), reverse=True)
+  
+  # Both passes draw from the same name generator, so the second one picks up
+  # where the first left off. The first pass gets the one letter names. The
+  # second is sorted by _s2, but each proposal is accepted or rejected by
+  # savings(len(name)) for the name it actually gets, which becomes 3 (and so
+  # on) once the two letter names run out.
+  for proposal in proposals[:len(VARIABLE_START)]:
+    name = names.next()
+    if proposal.savings(len(name)) <= 0:
       break
-    proposal.assign(VARIABLE_START[i])
+    proposal.assign(name)
     assigned.append(proposal)
   proposals = proposals[len(assigned):]
   
-  g = VariableGenerator(2)
-  
-  proposals.sort(key=lambda x:x.savings(2), reverse=True)
-  for i,proposal in enumerate(proposals):
-    if proposal.savings(2) <= 0:
+  proposals.sort(key=operator.attrgetter('_s2'), reverse=True)
+  for proposal in proposals:
+    name = names.next()
+    if proposal.savings(len(name)) <= 0:
       break
-    proposal.assign(g.next())
+    proposal.assign(name)
     assigned.append(proposal)
   
   
@@ -433,8 +496,11 @@ if __name__ == '__main__':
   if options.optimization_records:
     foreword_functions = ''.join([x.get_foreword() for x in proposals if isinstance(x,RecordProposal)])
   
+  result = []
   if len(proposals) > 0:
-    result = '(function(){%sreturn %s;})()' % (foreword_symbolizations+foreword_functions, writeJSON(structure, proposals, options=writer_options))
+    result.append('(function(){%sreturn ' % (foreword_symbolizations+foreword_functions))
+    writeJSON(structure, proposals, options=writer_options, out=result)
+    result.append(';})()')
   else:
-    result = writeJSON(structure, proposals, options=writer_options)
-  sys.stdout.write(result.encode('utf-8'))
\ No newline at end of file
+    writeJSON(structure, proposals, options=writer_options, out=result)
+  sys.stdout.write(''.join(result).encode('utf-8'))
\ No newline at end of file
@@ -14,14 +14,38 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import json, traceback, time, random, struct, math
-import LiteralOptimizers
+import json, traceback, time, random, struct, math, decimal
+import LiteralOptimizers, RCFJ
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+FLOAT_BATCH = 4096
+
+def random_floats():
+  """
+  Yield doubles with uniformly random bit patterns, skipping NaN and infinity
+  (these aren't part of the JSON spec). They're generated FLOAT_BATCH at a
+  time, by NumPy if it's available.
+  """
+  while True:
+    if numpy is not None:
+      bits = numpy.random.randint(0, 1 << 64, size=FLOAT_BATCH, dtype=numpy.uint64)
+      floats = bits.view(numpy.float64)
+      batch = floats[numpy.isfinite(floats)].tolist()
+    else:
+      bits = [random.getrandbits(64) for i in xrange(FLOAT_BATCH)]
+      floats = struct.unpack('%dd' % FLOAT_BATCH, struct.pack('%dQ' % FLOAT_BATCH, *bits))
+      batch = [f for f in floats if not (math.isnan(f) or math.isinf(f))]
+    for f in batch:
+      yield f
+
+_floats = random_floats()
 
 def float_fuzzer():
-  f = struct.unpack('d', struct.pack('L', random.getrandbits(64)))[0]
-  if math.isnan(f) or math.isinf(f):
-    # These aren't part of the JSON spec.
-    return True, None
+  f = _floats.next()
   try:
     if float(LiteralOptimizers.optimal_float(f)) == f:
       return True, None
@@ -36,18 +60,33 @@ def int_fuzzer():
     return True, None
   return False, i
 
-def string_fuzzer():
-  length = random.randint(0, 30)
-  chrs = []
-  for i in xrange(length):
-    if random.random() < 0.8:
-      chrs.append(unichr(random.randint(0,0x7f)))
+STRING_BATCH = 1024
+
+def random_strings():
+  """
+  Yield random unicode strings of up to 30 characters. Their characters are
+  generated for STRING_BATCH strings at a time, by NumPy if it's available.
+  """
+  # Making random well-formed unicode strings is hard. This test aims to at
+  # least stress ASCII + Control characters and some other Latin characters.
+  while True:
+    lengths = [random.randint(0, 30) for i in xrange(STRING_BATCH)]
+    total = sum(lengths)
+    if numpy is not None:
+      latin = numpy.random.random(total) >= 0.8
+      codes = numpy.where(latin, numpy.random.randint(0x100, 0x180, total), numpy.random.randint(0, 0x80, total))
+      chrs = codes.astype('<u4').tostring().decode('utf-32-le')
     else:
-      # Making random well-formed unicode strings is hard. This test aims to
-      # at least stress ASCII + Control characters and some other Latin
-      # characters.
-      chrs.append(unichr(random.randint(0x100, 0x17f)))
-  chrs = ''.join(chrs)
+      chrs = u''.join([unichr(random.randint(0,0x7f)) if random.random() < 0.8 else unichr(random.randint(0x100, 0x17f)) for i in xrange(total)])
+    start = 0
+    for length in lengths:
+      yield chrs[start:start + length]
+      start += length
+
+_strings = random_strings()
+
+def string_fuzzer():
+  chrs = _strings.next()
   try:
     if chrs != json.loads(LiteralOptimizers.optimal_string(chrs)):
       return False, chrs
@@ -61,12 +100,50 @@ def test_boolean():
   assert LiteralOptimizers.optimal_boolean(True, allowBooleanNumbers=True) == '1'
   assert LiteralOptimizers.optimal_boolean(False, allowBooleanNumbers=True) == '0'
 
+def test_int():
+  assert LiteralOptimizers.optimal_int(0) == '0'
+  assert LiteralOptimizers.optimal_int(100) == '100'
+  assert LiteralOptimizers.optimal_int(1000) == '1e3'
+  assert LiteralOptimizers.optimal_int(-25000) == '-25e3'
+  assert LiteralOptimizers.optimal_int(10**30) == '1e30'
+  assert LiteralOptimizers.optimal_int(123456789012345, allowHex=True) == '0x7048860ddf79'
+  # Anything '%d' accepts still works, not just ints.
+  assert LiteralOptimizers.optimal_int(5.0) == '5'
+  assert LiteralOptimizers.optimal_int(2000L) == '2e3'
+  assert LiteralOptimizers.optimal_int(True) == '1'
+
+def test_float():
+  assert LiteralOptimizers.optimal_float(0.5) == '.5'
+  assert LiteralOptimizers.optimal_float(-2.0) == '-2'
+  assert LiteralOptimizers.optimal_float(78.8999, sigdigits=2) == '79'
+  assert LiteralOptimizers.optimal_float(0.000123456, sigdigits=3) == '.000123'
+  assert LiteralOptimizers.optimal_float(decimal.Decimal('0.125'), sigdigits=2) == '.12'
+  assert LiteralOptimizers.optimal_float(decimal.Decimal('-3.14159'), sigdigits=3) == '-3.14'
+
+def test_string():
+  for s in ['', 'plain', 'tab\there', '"quoted" \\ back', '\x00\x1f\x7f', u'caf\xe9']:
+    assert LiteralOptimizers.optimal_string(s) == json.dumps(s), s
+
 def test_null():
   assert LiteralOptimizers.optimal_null(None) == 'null'
   assert LiteralOptimizers.optimal(None, None) == 'null'
 
 
-tests = [test_boolean, test_null]
+def test_symbolized_booleans():
+  # True == 1 in Python, but symbolization mustn't mix the two up.
+  struct = [True]*20 + [1]*20
+  proposals = RCFJ.assign_proposals_greedy(RCFJ.generate_symbolized_literal_proposals(struct))
+  written = RCFJ.writeJSON(struct, proposals)
+  items = written.strip('[]').split(',')
+  assert len(set(items[:20])) == 1 and len(set(items[20:])) == 1, written
+  assert items[0] != items[20], written
+
+def test_variable_names():
+  names = list(RCFJ.VariableGenerator(2))
+  assert len(set(names)) == len(names)
+  assert 'in' not in names and 'do' not in names
+
+tests = [test_boolean, test_int, test_float, test_string, test_null, test_symbolized_booleans, test_variable_names]
 for test in tests:
   try:
     print('')
@@ -81,10 +158,14 @@ fuzzers = [float_fuzzer, int_fuzzer, string_fuzzer]
 FUZZER_TIME = 1.0
 
 for fuzzer in fuzzers:
-  start = time.clock()
+  start = time.time()
+  end = start + FUZZER_TIME
   iterations = 0
   failures = []
-  while time.clock() - start < FUZZER_TIME:
+  while True:
+    # Only look at the clock every so often, it's slower than the fuzzers are.
+    if iterations % 1024 == 0 and time.time() > end:
+      break
     try:
       worked, case = fuzzer()
       if not worked:
@@ -93,5 +174,5 @@ for fuzzer in fuzzers:
       pass
     iterations += 1
   print('')
-  print('Ran {0} for {1:n} iterations ({2:.2f}s wall time)'.format(fuzzer.__name__, iterations, time.clock()-start))
+  print('Ran {0} for {1:n} iterations ({2:.2f}s wall time)'.format(fuzzer.__name__, iterations, time.time()-start))
   print('\t%d cases failed' % len(failures))